@@ -8,13 +8,22 @@ Supports: XLSX, CSV, OFX, PDF files
 import os
 import json
 import shutil
+import socket
+import stat
+import time
+import uuid
 import sqlite3
 import hashlib
 import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
-import cgi
+from email.message import Message
+from email.utils import collapse_rfc2231_value
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -31,76 +40,228 @@ ALLOWED_EXTENSIONS = {
 }
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_UPLOAD_FILES = 20  # files per upload request
+MAX_NOTES_SIZE = 64 * 1024  # 64KB per non-file form field
+MAX_REQUEST_SIZE = MAX_FILE_SIZE * MAX_UPLOAD_FILES + 1024 * 1024  # plus slack for part headers and notes
+HASH_BUFSIZE = 1 << 20  # 1MB read/write chunk for hashing and copying
+
+# Compact JSON encoder and CORS headers shared by every response
+_ENCODE_JSON = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+)
+
+# Load the MIME database once at startup rather than on the first download
+mimetypes.init()
+
+# Shared SQLite connection (WAL mode), serialized across handler threads
+_CONN = None
+_DB_LOCK = threading.Lock()
+
+# Last get_stats() result, recomputed only after uploads or deletes
+_stats_cache = {'data': None, 'dirty': True}
+
+def _dict_factory(cursor, row):
+    """Build each result row directly as a dict keyed by column name"""
+    return {column[0]: row[i] for i, column in enumerate(cursor.description)}
+
+def get_connection():
+    """Return the shared SQLite connection, opening it on first use"""
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(DATABASE_PATH, check_same_thread=False, isolation_level=None)
+        _CONN.row_factory = _dict_factory
+        _CONN.execute('PRAGMA journal_mode=WAL')
+        _CONN.execute('PRAGMA synchronous=NORMAL')
+        _CONN.execute('PRAGMA temp_store=MEMORY')
+    return _CONN
+
+@contextmanager
+def db_transaction():
+    """Run a block of writes in one transaction on the shared connection"""
+    with _DB_LOCK:
+        cursor = get_connection().cursor()
+        cursor.execute('BEGIN')
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
 
 def init_database():
     """Initialize SQLite database for file metadata"""
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
     
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            original_name TEXT NOT NULL,
-            file_type TEXT NOT NULL,
-            file_size INTEGER NOT NULL,
-            file_hash TEXT NOT NULL,
-            upload_date TEXT NOT NULL,
-            status TEXT DEFAULT 'uploaded',
-            metadata TEXT,
-            notes TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS file_tags (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id INTEGER NOT NULL,
-            tag TEXT NOT NULL,
-            FOREIGN KEY (file_id) REFERENCES files (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with db_transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                original_name TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                file_hash TEXT NOT NULL,  -- BLAKE2b-128 hex digest
+                upload_date TEXT NOT NULL,
+                status TEXT DEFAULT 'uploaded',
+                metadata TEXT,
+                notes TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id INTEGER NOT NULL,
+                tag TEXT NOT NULL,
+                FOREIGN KEY (file_id) REFERENCES files (id)
+            )
+        ''')
+        
+        # Listing sorts by date, stats group by type, deletes look up tags by file,
+        # uploads look for duplicates by hash
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files(upload_date DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_type ON files(file_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tags_file ON file_tags(file_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_hash ON files(file_hash)')
+        
+        # Refresh planner statistics so the indexes are used
+        cursor.execute('ANALYZE')
+
+def new_file_hasher():
+    """Create the content fingerprint hasher (128-bit BLAKE2b, not a security hash)"""
+    return hashlib.blake2b(digest_size=16)
 
 def get_file_hash(filepath):
-    """Calculate MD5 hash of file"""
-    hash_md5 = hashlib.md5()
+    """Calculate content hash of file"""
+    hasher = new_file_hasher()
     with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        while True:
+            chunk = f.read(HASH_BUFSIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# str.translate table for ASCII: keep alphanumerics and '._-', map the rest to '_'
+_SAFE_TABLE = {i: (chr(i) if chr(i).isalnum() or chr(i) in '._-' else '_') for i in range(128)}
 
+def sanitize_filename(filename):
+    """Replace characters other than alphanumerics and '._-' with '_'"""
+    safe_name = filename.translate(_SAFE_TABLE)
+    if not safe_name.isascii():
+        # Non-ASCII characters pass through the table unchanged; check them one by one
+        safe_name = ''.join(c if c.isascii() or c.isalnum() else '_' for c in safe_name)
+    return safe_name
+
+@lru_cache(maxsize=512)
 def get_file_type(filename):
     """Determine file type from extension"""
-    ext = os.path.splitext(filename)[1].lower()
-    return ALLOWED_EXTENSIONS.get(ext, 'unknown')
+    name, dot, ext = filename.rpartition('.')
+    if not dot or not name.lstrip('.'):
+        return 'unknown'
+    return ALLOWED_EXTENSIONS.get('.' + ext.lower(), 'unknown')
+
+@lru_cache(maxsize=512)
+def _guess_mime(filepath):
+    """Guess MIME type for a path, falling back to a generic binary type"""
+    mime_type, _ = mimetypes.guess_type(filepath)
+    return mime_type or 'application/octet-stream'
+
+class PartTooLarge(Exception):
+    """Raised when a multipart part (file or form field) exceeds its size limit mid-stream"""
 
-def save_file(file_item, upload_dir):
-    """Save uploaded file and return metadata"""
-    filename = file_item.filename
+def claim_upload_name(upload_dir, base_name):
+    """Reserve an unused filename in upload_dir by creating it exclusively"""
+    stem, _, ext = base_name.rpartition('.')
+    counter = 0
+    while True:
+        candidate = base_name if counter == 0 else f"{stem}_{counter}.{ext}"
+        try:
+            fd = os.open(os.path.join(upload_dir, candidate), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            counter += 1
+            continue
+        os.close(fd)
+        return candidate
+
+def save_file(filename, chunks, upload_dir):
+    """Save uploaded file from an iterable of byte chunks and return metadata"""
     file_type = get_file_type(filename)
     
     if file_type == 'unknown':
+        for _ in chunks:
+            pass
         return None, "File type not allowed"
     
-    # Generate unique filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    safe_name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in filename)
-    unique_filename = f"{timestamp}_{safe_name}"
-    
-    filepath = os.path.join(upload_dir, unique_filename)
-    
-    # Save file
-    with open(filepath, 'wb') as f:
-        shutil.copyfileobj(file_item.file, f)
+    # Save file to a private temp path, hashing each chunk as it is written
+    temp_path = os.path.join(upload_dir, f'.{uuid.uuid4().hex}.part')
+    hasher = new_file_hasher()
+    file_size = 0
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        for chunk in chunks:
+            if file_size + len(chunk) > MAX_FILE_SIZE:
+                raise PartTooLarge(f'{filename} exceeds the {MAX_FILE_SIZE // (1024 * 1024)}MB limit')
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+            hasher.update(chunk)
+            file_size += len(chunk)
+    except BaseException:
+        # Don't leave a partial upload behind if the stream breaks off
+        os.close(fd)
+        os.remove(temp_path)
+        raise
     
     # Get file info
-    file_size = os.path.getsize(filepath)
-    file_hash = get_file_hash(filepath)
+    file_hash = hasher.hexdigest()
+    
+    try:
+        # Share storage with an identical earlier upload: swap the temp copy
+        # for a hard link to it (links are only ever replaced, never written)
+        existing = find_file_by_hash(file_hash)
+        linked = False
+        if existing:
+            link_path = os.path.join(upload_dir, f'.{uuid.uuid4().hex}.link')
+            try:
+                os.link(os.path.join(upload_dir, existing['filename']), link_path)
+                os.replace(link_path, temp_path)
+                linked = True
+            except OSError:
+                # Original gone or links unsupported: keep the copy just written
+                if os.path.exists(link_path):
+                    os.remove(link_path)
+        
+        # Drop a newly stored upload from the page cache so it doesn't evict
+        # hot files; only clean pages can be dropped, so flush them first.
+        # Duplicates are discarded above without ever being synced.
+        if not linked and hasattr(os, 'posix_fadvise'):
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, file_size, os.POSIX_FADV_DONTNEED)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    finally:
+        os.close(fd)
+    
+    # Generate unique filename; concurrent uploads of the same name in the
+    # same second get a numeric suffix instead of sharing a file
+    now = datetime.now()
+    timestamp = now.strftime('%Y%m%d_%H%M%S')
+    safe_name = sanitize_filename(filename)
+    unique_filename = None
+    try:
+        unique_filename = claim_upload_name(upload_dir, f"{timestamp}_{safe_name}")
+        os.replace(temp_path, os.path.join(upload_dir, unique_filename))
+    except BaseException:
+        # Remove the temp file and any empty placeholder claimed for it
+        os.remove(temp_path)
+        if unique_filename:
+            os.remove(os.path.join(upload_dir, unique_filename))
+        raise
     
     return {
         'filename': unique_filename,
@@ -108,67 +269,76 @@ def save_file(file_item, upload_dir):
         'file_type': file_type,
         'file_size': file_size,
         'file_hash': file_hash,
-        'upload_date': datetime.now().isoformat()
+        'upload_date': now.isoformat()
     }, None
 
-def add_file_to_db(file_info, notes=None):
-    """Add file metadata to database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO files (filename, original_name, file_type, file_size, file_hash, upload_date, status, notes)
-        VALUES (?, ?, ?, ?, ?, ?, 'uploaded', ?)
-    ''', (
-        file_info['filename'],
-        file_info['original_name'],
-        file_info['file_type'],
-        file_info['file_size'],
-        file_info['file_hash'],
-        file_info['upload_date'],
-        notes
-    ))
-    
-    file_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return file_id
+def discard_files(file_infos):
+    """Remove saved files belonging to a rejected upload request"""
+    for file_info in file_infos:
+        filepath = os.path.join(UPLOAD_DIR, file_info['filename'])
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+def add_file_to_db(file_infos, notes=None):
+    """Add metadata for a batch of files in one transaction, return their IDs"""
+    with db_transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO files (filename, original_name, file_type, file_size, file_hash, upload_date, status, notes)
+            VALUES (?, ?, ?, ?, ?, ?, 'uploaded', ?)
+        ''', [(
+            file_info['filename'],
+            file_info['original_name'],
+            file_info['file_type'],
+            file_info['file_size'],
+            file_info['file_hash'],
+            file_info['upload_date'],
+            notes
+        ) for file_info in file_infos])
+        
+        # Rows inserted in a single transaction get consecutive AUTOINCREMENT IDs
+        cursor.execute('SELECT last_insert_rowid() AS last_id')
+        last_id = cursor.fetchone()['last_id']
+        _stats_cache['dirty'] = True
+    
+    return list(range(last_id - len(file_infos) + 1, last_id + 1))
 
 def get_all_files():
     """Get all files from database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, filename, original_name, file_type, file_size, 
-               file_hash, upload_date, status, notes
-        FROM files
-        ORDER BY upload_date DESC
-    ''')
-    
-    files = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with _DB_LOCK:
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT id, filename, original_name, file_type, file_size, 
+                   file_hash, upload_date, status, notes
+            FROM files
+            ORDER BY upload_date DESC
+        ''')
+        
+        files = cursor.fetchall()
     
     return files
 
 def get_file_by_id(file_id):
     """Get file by ID"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, filename, original_name, file_type, file_size, 
-               file_hash, upload_date, status, notes
-        FROM files WHERE id = ?
-    ''', (file_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
+    with _DB_LOCK:
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT id, filename, original_name, file_type, file_size, 
+                   file_hash, upload_date, status, notes
+            FROM files WHERE id = ?
+        ''', (file_id,))
+        
+        row = cursor.fetchone()
     
-    return dict(row) if row else None
+    return row
+
+def find_file_by_hash(file_hash):
+    """Get an existing file with the given content hash, if any"""
+    with _DB_LOCK:
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT id, filename FROM files WHERE file_hash = ? LIMIT 1', (file_hash,))
+        row = cursor.fetchone()
+    
+    return row
 
 def delete_file(file_id):
     """Delete file from database and filesystem"""
@@ -182,106 +352,291 @@ def delete_file(file_id):
         os.remove(filepath)
     
     # Delete from database
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
-    cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (file_id,))
-    conn.commit()
-    conn.close()
+    with db_transaction() as cursor:
+        cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (file_id,))
+        _stats_cache['dirty'] = True
     
     return True, None
 
 def get_stats():
     """Get upload statistics"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM files')
-    total_files = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COALESCE(SUM(file_size), 0) FROM files')
-    total_size = cursor.fetchone()[0]
-    
-    cursor.execute('''
-        SELECT file_type, COUNT(*) as count 
-        FROM files 
-        GROUP BY file_type
-    ''')
-    by_type = {row[0]: row[1] for row in cursor.fetchall()}
-    
-    conn.close()
+    with _DB_LOCK:
+        if not _stats_cache['dirty']:
+            return _stats_cache['data']
+        
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT COUNT(*) AS total_files FROM files')
+        total_files = cursor.fetchone()['total_files']
+        
+        cursor.execute('SELECT COALESCE(SUM(file_size), 0) AS total_size FROM files')
+        total_size = cursor.fetchone()['total_size']
+        
+        cursor.execute('''
+            SELECT file_type, COUNT(*) as count 
+            FROM files 
+            GROUP BY file_type
+        ''')
+        by_type = {row['file_type']: row['count'] for row in cursor.fetchall()}
+        
+        _stats_cache['data'] = {
+            'total_files': total_files,
+            'total_size': total_size,
+            'by_type': by_type
+        }
+        _stats_cache['dirty'] = False
+        return _stats_cache['data']
+
+def rehash_files(migrate=False):
+    """Recompute every stored file's hash in parallel, rewriting mismatches only when migrating"""
+    with _DB_LOCK:
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT id, filename, file_hash FROM files')
+        rows = cursor.fetchall()
+    
+    def hash_row(row):
+        try:
+            return get_file_hash(os.path.join(UPLOAD_DIR, row['filename'])), None
+        except FileNotFoundError:
+            return None, 'missing'
+        except OSError:
+            return None, 'unreadable'
+    
+    # hashlib releases the GIL on large updates, so files hash on separate cores
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        results = list(executor.map(hash_row, rows))
+    
+    missing = [row['id'] for row, (_, error) in zip(rows, results) if error == 'missing']
+    unreadable = [row['id'] for row, (_, error) in zip(rows, results) if error == 'unreadable']
+    mismatched = [(file_hash, row['id']) for row, (file_hash, _) in zip(rows, results)
+                  if file_hash is not None and file_hash != row['file_hash']]
+    
+    if migrate and mismatched:
+        with db_transaction() as cursor:
+            cursor.executemany('UPDATE files SET file_hash = ? WHERE id = ?', mismatched)
     
     return {
-        'total_files': total_files,
-        'total_size': total_size,
-        'by_type': by_type
+        'checked': len(rows),
+        'mismatched': [file_id for _, file_id in mismatched],
+        'updated': [file_id for _, file_id in mismatched] if migrate else [],
+        'missing': missing,
+        'unreadable': unreadable
     }
 
+def get_header_param(headers, param, header):
+    """Get a header parameter as str, decoding RFC 2231 (param*=charset'lang'value) forms"""
+    value = headers.get_param(param, header=header)
+    if isinstance(value, tuple):
+        value = collapse_rfc2231_value(value)
+    return value
+
+
+class MultipartParser:
+    """Streaming multipart/form-data parser reading directly from the request body"""
+    
+    MAX_HEADER_SIZE = 16 * 1024
+    
+    def __init__(self, rfile, boundary, content_length):
+        self.rfile = rfile
+        self.remaining = content_length
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # Leading CRLF lets the first boundary match the same delimiter as the rest
+        self.buffer = b'\r\n'
+        self.started = False
+        self.done = False
+    
+    def _fill(self):
+        """Read the next block of the body into the buffer, False at end of body"""
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(HASH_BUFSIZE, self.remaining))
+        if not data:
+            return False
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+    
+    def _skip_to_delimiter(self):
+        """Discard the preamble up to and including the first delimiter"""
+        while (idx := self.buffer.find(self.delimiter)) < 0:
+            self.buffer = self.buffer[-len(self.delimiter):]
+            if not self._fill():
+                raise ValueError('Malformed multipart body')
+        self.buffer = self.buffer[idx + len(self.delimiter):]
+    
+    def next_part(self):
+        """Advance to the next part and return its (name, filename), or None at the end"""
+        if self.done:
+            return None
+        if not self.started:
+            self._skip_to_delimiter()
+            self.started = True
+        
+        # A delimiter is followed by '--' for the last part, else CRLF and headers
+        while True:
+            if self.buffer.startswith(b'--'):
+                self.done = True
+                return None
+            if (idx := self.buffer.find(b'\r\n\r\n')) >= 0:
+                break
+            if len(self.buffer) > self.MAX_HEADER_SIZE or not self._fill():
+                raise ValueError('Malformed multipart body')
+        
+        header_lines = self.buffer[:idx].decode('utf-8', 'replace').split('\r\n')
+        self.buffer = self.buffer[idx + 4:]
+        
+        headers = Message()
+        for line in header_lines[1:]:
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip()] = value.strip()
+        name = get_header_param(headers, 'name', 'content-disposition')
+        filename = get_header_param(headers, 'filename', 'content-disposition')
+        return name, filename
+    
+    def iter_part(self, limit=None):
+        """Yield the current part's body in chunks, stopping at the next delimiter"""
+        keep = len(self.delimiter) - 1
+        size = 0
+        while True:
+            idx = self.buffer.find(self.delimiter)
+            if idx >= 0:
+                chunk, self.buffer = self.buffer[:idx], self.buffer[idx + len(self.delimiter):]
+                done = True
+            elif len(self.buffer) > keep:
+                # Hold back a possible partial delimiter at the end of the buffer
+                chunk, self.buffer = self.buffer[:-keep], self.buffer[-keep:]
+                done = False
+            else:
+                chunk, done = b'', False
+            
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise PartTooLarge(f'Form field exceeds the {limit // 1024}KB limit')
+            if chunk:
+                yield chunk
+            if done:
+                return
+            if not self._fill():
+                raise ValueError('Unexpected end of multipart body')
+    
+    def read_part(self, limit=None):
+        """Return the current part's body as bytes, at most limit bytes if given"""
+        return b''.join(self.iter_part(limit))
+
 
 class JBsnRequestHandler(BaseHTTPRequestHandler):
     """Custom request handler for JBsn API"""
     
+    # Buffer headers and body so small responses leave in a single send()
+    wbufsize = 1 << 18
+    disable_nagle_algorithm = True
+    
+    # (epoch second, formatted timestamp) shared by log lines within the same second
+    _log_stamp = (None, '')
+    
+    def set_cork(self, enabled):
+        """Toggle TCP_CORK so headers and sendfile data share packets (Linux only)"""
+        if hasattr(socket, 'TCP_CORK'):
+            try:
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(enabled))
+            except OSError:
+                pass
+    
     def log_message(self, format, *args):
         """Override to customize logging"""
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {args[0]}")
+        second = int(time.time())
+        stamp_second, stamp = JBsnRequestHandler._log_stamp
+        if second != stamp_second:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+            JBsnRequestHandler._log_stamp = (second, stamp)
+        print(f"[{stamp}] {args[0]}")
     
     def send_json(self, data, status=200):
         """Send JSON response"""
-        response = json.dumps(data).encode('utf-8')
+        response = _ENCODE_JSON(data).encode('utf-8')
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(response))
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        for header, value in CORS_HEADERS:
+            self.send_header(header, value)
         self.end_headers()
         self.wfile.write(response)
     
     def send_file_response(self, filepath, filename):
         """Send file download response"""
-        if not os.path.exists(filepath):
+        try:
+            st = os.stat(filepath)
+        except (OSError, ValueError):
+            self.send_error(404, 'File not found')
+            return
+        if not stat.S_ISREG(st.st_mode):
             self.send_error(404, 'File not found')
             return
         
-        mime_type, _ = mimetypes.guess_type(filepath)
-        if not mime_type:
-            mime_type = 'application/octet-stream'
-        
-        file_size = os.path.getsize(filepath)
+        mime_type = _guess_mime(filepath)
         
-        self.send_response(200)
-        self.send_header('Content-Type', mime_type)
-        self.send_header('Content-Length', file_size)
-        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
+        file_size = st.st_size
         
-        with open(filepath, 'rb') as f:
-            shutil.copyfileobj(f, self.wfile)
+        self.set_cork(True)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', mime_type)
+            self.send_header('Content-Length', file_size)
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            with open(filepath, 'rb') as f:
+                # Zero-copy from page cache to socket where supported
+                self.wfile.flush()
+                offset = 0
+                try:
+                    sock_fd = self.connection.fileno()
+                    while offset < file_size:
+                        sent = os.sendfile(sock_fd, f.fileno(), offset, file_size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                except (AttributeError, OSError):
+                    # No sendfile (e.g. Windows): copy whatever is left through userspace
+                    f.seek(offset)
+                    shutil.copyfileobj(f, self.wfile, length=HASH_BUFSIZE)
+                    self.wfile.flush()
+        finally:
+            self.set_cork(False)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        for header, value in CORS_HEADERS:
+            self.send_header(header, value)
         self.end_headers()
     
+    def handle_files(self):
+        """GET /api/files"""
+        files = get_all_files()
+        self.send_json({'success': True, 'files': files})
+    
+    def handle_stats(self):
+        """GET /api/stats"""
+        stats = get_stats()
+        self.send_json({'success': True, 'stats': stats})
+    
+    # Exact-match GET API routes
+    GET_ROUTES = {
+        '/api/files': handle_files,
+        '/api/stats': handle_stats,
+    }
+    
     def do_GET(self):
         """Handle GET requests"""
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
-        query = parse_qs(parsed_path.query)
+        path = self.path.partition('?')[0]
         
         # API Routes
-        if path == '/api/files':
-            files = get_all_files()
-            self.send_json({'success': True, 'files': files})
-            return
-        
-        if path == '/api/stats':
-            stats = get_stats()
-            self.send_json({'success': True, 'stats': stats})
+        handler = self.GET_ROUTES.get(path)
+        if handler:
+            handler(self)
             return
         
         if path.startswith('/api/download/'):
@@ -315,15 +670,49 @@ class JBsnRequestHandler(BaseHTTPRequestHandler):
         else:
             filepath = os.path.join(FRONTEND_DIR, path.lstrip('/'))
         
-        if os.path.exists(filepath) and os.path.isfile(filepath):
-            self.send_file_response(filepath, os.path.basename(filepath))
-        else:
-            self.send_error(404, 'File not found')
+        self.send_file_response(filepath, os.path.basename(filepath))
+    
+    def receive_upload(self, parser):
+        """Stream upload parts to disk and record them, return (uploaded, errors)"""
+        uploaded_files = []
+        errors = []
+        notes = ''
+        file_count = 0
+        
+        try:
+            # Stream each file part straight to disk as it arrives
+            while (part := parser.next_part()) is not None:
+                name, filename = part
+                if name == 'files' and filename:
+                    file_count += 1
+                    if file_count > MAX_UPLOAD_FILES:
+                        raise ValueError(f'Too many files (maximum {MAX_UPLOAD_FILES} per upload)')
+                    file_info, error = save_file(filename, parser.iter_part(), UPLOAD_DIR)
+                    if error:
+                        errors.append({'filename': filename, 'error': error})
+                    else:
+                        uploaded_files.append(file_info)
+                elif name == 'notes':
+                    notes = parser.read_part(MAX_NOTES_SIZE).decode('utf-8', 'replace')
+                else:
+                    for _ in parser.iter_part(MAX_NOTES_SIZE):
+                        pass
+            
+            # Batch insert once the whole body has been read
+            if uploaded_files:
+                file_ids = add_file_to_db(uploaded_files, notes)
+                for file_info, file_id in zip(uploaded_files, file_ids):
+                    file_info['id'] = file_id
+        except BaseException:
+            # Never leave files from a failed request on disk without a row
+            discard_files(uploaded_files)
+            raise
+        
+        return uploaded_files, errors
     
     def do_POST(self):
         """Handle POST requests"""
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
+        path = self.path.partition('?')[0]
         
         if path == '/api/upload':
             content_type = self.headers.get('Content-Type', '')
@@ -332,36 +721,26 @@ class JBsnRequestHandler(BaseHTTPRequestHandler):
                 self.send_json({'success': False, 'error': 'Expected multipart/form-data'}, 400)
                 return
             
+            boundary = get_header_param(self.headers, 'boundary', 'content-type')
+            if not boundary:
+                self.send_json({'success': False, 'error': 'Missing multipart boundary'}, 400)
+                return
+            
             try:
-                form = cgi.FieldStorage(
-                    fp=self.rfile,
-                    headers=self.headers,
-                    environ={
-                        'REQUEST_METHOD': 'POST',
-                        'CONTENT_TYPE': content_type
-                    }
-                )
-                
-                uploaded_files = []
-                errors = []
-                
-                # Handle single or multiple files
-                file_items = form['files'] if 'files' in form else []
-                if not isinstance(file_items, list):
-                    file_items = [file_items]
-                
-                notes = form.getvalue('notes', '')
-                
-                for item in file_items:
-                    if item.filename:
-                        file_info, error = save_file(item, UPLOAD_DIR)
-                        
-                        if error:
-                            errors.append({'filename': item.filename, 'error': error})
-                        else:
-                            file_id = add_file_to_db(file_info, notes)
-                            file_info['id'] = file_id
-                            uploaded_files.append(file_info)
+                content_length = int(self.headers.get('Content-Length', ''))
+            except ValueError:
+                self.send_json({'success': False, 'error': 'Content-Length required'}, 411)
+                return
+            
+            # Refuse before reading any of the body
+            if content_length > MAX_REQUEST_SIZE:
+                self.close_connection = True
+                self.send_json({'success': False, 'error': 'Upload too large'}, 413)
+                return
+            
+            try:
+                parser = MultipartParser(self.rfile, boundary, content_length)
+                uploaded_files, errors = self.receive_upload(parser)
                 
                 response = {
                     'success': len(uploaded_files) > 0,
@@ -373,6 +752,20 @@ class JBsnRequestHandler(BaseHTTPRequestHandler):
                 status = 200 if uploaded_files else 400
                 self.send_json(response, status)
                 
+            except PartTooLarge as e:
+                # Stop reading the rest of the body; the connection is dropped
+                self.close_connection = True
+                self.send_json({'success': False, 'error': str(e)}, 413)
+            except ValueError as e:
+                self.send_json({'success': False, 'error': str(e)}, 400)
+            except Exception as e:
+                self.send_json({'success': False, 'error': str(e)}, 500)
+        elif path == '/api/rehash':
+            query = parse_qs(self.path.partition('?')[2])
+            migrate = query.get('migrate', ['0'])[0] in ('1', 'true')
+            try:
+                result = rehash_files(migrate)
+                self.send_json({'success': True, 'rehash': result})
             except Exception as e:
                 self.send_json({'success': False, 'error': str(e)}, 500)
         else:
@@ -390,7 +783,7 @@ def main():
     
     # Start server
     server_address = ('', 8080)
-    httpd = HTTPServer(server_address, JBsnRequestHandler)
+    httpd = ThreadingHTTPServer(server_address, JBsnRequestHandler)
     
     print(f"""
 ╔══════════════════════════════════════════════════════════╗
@@ -400,6 +793,7 @@ def main():
 ║  Upload endpoint:   POST /api/upload                     ║
 ║  Files endpoint:    GET  /api/files                      ║
 ║  Stats endpoint:    GET  /api/stats                      ║
+║  Rehash endpoint:   POST /api/rehash                     ║
 ║  Upload directory:  {UPLOAD_DIR:<36} ║
 ╚══════════════════════════════════════════════════════════╝
     """)